@@ -0,0 +1,65 @@
+"""
+Benchmarks feature extraction throughput on local tiles.
+
+Compares the full eager efficientnet_b0 (hook-based reference) against the
+truncated feature trunk and checks that their embeddings match.
+
+Usage (from the repository root):
+    python -m backend.benchmark_features --tiles 256 --batch-size 32
+"""
+import argparse
+import os
+import time
+
+from PIL import Image
+
+from backend.main import (
+    TILES_ROOT,
+    TORCH_NUM_THREADS,
+    TORCH_INTEROP_THREADS,
+    FEATURE_TRUNK_TORCHSCRIPT,
+    check_feature_parity,
+    extract_features_batch,
+    extract_features_reference,
+)
+
+def collect_tiles(limit: int):
+    """Collects up to `limit` PNG tiles from the local tile store."""
+    tiles = []
+    for root, _, files in os.walk(TILES_ROOT):
+        for file in sorted(files):
+            if not file.endswith(".png"): continue
+            tiles.append(Image.open(os.path.join(root, file)).convert("RGB"))
+            if len(tiles) >= limit:
+                return tiles
+    return tiles
+
+def tiles_per_second(extract, tiles, batch_size: int) -> float:
+    extract(tiles[:batch_size])  # warm-up
+    start = time.perf_counter()
+    for i in range(0, len(tiles), batch_size):
+        extract(tiles[i:i + batch_size])
+    return len(tiles) / (time.perf_counter() - start)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark feature extraction backends.")
+    parser.add_argument("--tiles", type=int, default=256, help="Number of tiles to embed")
+    parser.add_argument("--batch-size", type=int, default=32)
+    args = parser.parse_args()
+
+    tiles = collect_tiles(args.tiles)
+    if not tiles:
+        print(f"No tiles found under {TILES_ROOT}")
+        return
+    print(f"Threads: intra-op={TORCH_NUM_THREADS}, inter-op={TORCH_INTEROP_THREADS}, TorchScript={FEATURE_TRUNK_TORCHSCRIPT}")
+
+    max_diff = check_feature_parity(tiles[:args.batch_size])
+    print(f"Parity: max abs diff {max_diff:.2e}")
+
+    for name, extract in (("reference (full model)", extract_features_reference), ("feature trunk", extract_features_batch)):
+        for batch_size in (1, args.batch_size):
+            rate = tiles_per_second(extract, tiles, batch_size)
+            print(f"{name:24s} batch={batch_size:<3d} {rate:8.1f} tiles/sec")
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,13 @@
-from fastapi import FastAPI, HTTPException, Body
-from fastapi.responses import FileResponse, Response
+from fastapi import FastAPI, HTTPException, Body, Request, Query
+from fastapi.responses import FileResponse, Response, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-import os, json, math, shutil
-from typing import List, Dict, Union
+import os, sys, json, math, shutil, time, threading, multiprocessing, hashlib, uuid
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from typing import List, Dict, Union, Tuple, Optional
 from PIL import Image, ImageOps
 import torch
 import torch.nn as nn
@@ -13,7 +17,8 @@ from timm.data import resolve_model_data_config
 from timm.data.transforms_factory import create_transform
 import faiss
 from rasterio.transform import from_bounds
-from shapely.geometry import shape, box
+from shapely.geometry import shape, box, Point
+from shapely.strtree import STRtree
 import requests
 
 # ===================================================================
@@ -27,6 +32,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing"],
 )
 
 # ===================================================================
@@ -39,16 +45,229 @@ ANNOTATIONS_DIR = os.path.join(BASE_DIR, "database/annotations")
 FAISS_INDEX_ROOT = os.path.join(BASE_DIR, "database/faiss_indexes")
 TILE_MAP_ROOT = os.path.join(BASE_DIR, "database/tile_maps")
 EMBEDDINGS_ROOT = os.path.join(BASE_DIR, "database/embeddings")
+INDEX_BUNDLE_ROOT = os.path.join(BASE_DIR, "database/index_bundles")
+# Footprint catalogs written by fetch_footprints.py, named <dataset>_footprints.json
+FOOTPRINT_CATALOG_DIRS = [os.path.join(BASE_DIR, "frontend/public"), os.path.join(BASE_DIR, "frontend/static")]
 
 # Create necessary directories on startup
 os.makedirs(ANNOTATIONS_DIR, exist_ok=True)
 os.makedirs(FAISS_INDEX_ROOT, exist_ok=True)
 os.makedirs(TILE_MAP_ROOT, exist_ok=True)
 os.makedirs(EMBEDDINGS_ROOT, exist_ok=True)
+os.makedirs(INDEX_BUNDLE_ROOT, exist_ok=True)
+
+# Number of index bundle versions kept on disk per footprint/zoom
+INDEX_BUNDLE_KEEP_VERSIONS = 2
+# Temp bundle dirs older than this are removed even if their writer pid looks alive
+INDEX_BUNDLE_TEMP_MAX_AGE_SECONDS = 24 * 3600
+
+# Micro-batching window for concurrent similarity queries
+SIMILAR_BATCH_WINDOW_MS = 5
+SIMILAR_BATCH_MAX_SIZE = 32
+
+# Paginated similarity search sessions
+SEARCH_SESSION_TTL_SECONDS = 600
+SEARCH_SESSION_MAX = 1000
+SEARCH_SESSION_INITIAL_K = 50
+
+# Tile pre-filter applied before embedding during indexing
+BLANK_TILE_STD_THRESHOLD = 2.0     # Grayscale std-dev below this is a uniform tile
+NODATA_FRACTION_THRESHOLD = 0.98   # Fraction of black/transparent pixels marking a no-data tile
+DEDUPE_TILES = True                # Collapse tiles with identical perceptual hashes
+INDEX_EMBED_BATCH_SIZE = 32
+
+# Page size limits for footprint catalog queries
+CATALOG_PAGE_SIZE = 50
+CATALOG_MAX_PAGE_SIZE = 500
+
+# Threads used to write locally derived pyramid tiles
+PYRAMID_WORKERS = os.cpu_count() or 1
+
+# Default torch threads per indexing worker process
+INDEX_THREADS_PER_WORKER = int(os.environ.get("ANVESHAK_INDEX_THREADS_PER_WORKER", 4))
+
+# Latency histogram buckets (seconds) for instrumented stages
+STAGE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Clients send this header to get a per-request Server-Timing breakdown
+TIMING_REQUEST_HEADER = "X-Timing"
 
 ingestion_jobs: Dict[str, Dict] = {}
 faiss_indexes: Dict[tuple, "FaissIndex"] = {}
 
+# ===================================================================
+# Metrics & Profiling
+# ===================================================================
+
+class Histogram:
+    """Thread-safe cumulative histogram in the Prometheus style."""
+    def __init__(self, buckets=STAGE_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        with self._lock:
+            self.count += 1
+            self.sum += value
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self.counts[i] += 1
+
+    def merge(self, counts: List[int], count: int, total: float):
+        """Adds another histogram's bucket counts, count and sum (same buckets)."""
+        with self._lock:
+            self.count += count
+            self.sum += total
+            for i, bucket_count in enumerate(counts):
+                self.counts[i] += bucket_count
+
+stage_histograms: Dict[str, Histogram] = {}
+counters: Counter = Counter()
+metrics_lock = threading.Lock()
+
+# Per-request {stage: seconds} breakdown, set by the timing middleware
+request_timings: ContextVar[Union[Dict[str, float], None]] = ContextVar("request_timings", default=None)
+
+def observe_stage(stage: str, seconds: float, timings: Union[Dict[str, float], None] = None):
+    """Records a stage duration in its histogram and in the request breakdown, if any."""
+    with metrics_lock:
+        histogram = stage_histograms.get(stage)
+        if histogram is None:
+            histogram = stage_histograms[stage] = Histogram()
+    histogram.observe(seconds)
+    if timings is None:
+        timings = request_timings.get()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + seconds
+
+@contextmanager
+def timed(stage: str):
+    """Times the enclosed block as `stage`."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - start)
+
+def increment(name: str, amount: int = 1):
+    """Increments a named counter."""
+    with metrics_lock:
+        counters[name] += amount
+
+def drain_metrics() -> Dict:
+    """Returns the histograms and counters recorded so far as plain data and resets them."""
+    with metrics_lock:
+        histograms = list(stage_histograms.items())
+        counter_items = dict(counters)
+        stage_histograms.clear()
+        counters.clear()
+    drained = {}
+    for stage, histogram in histograms:
+        with histogram._lock:
+            drained[stage] = (list(histogram.counts), histogram.count, histogram.sum)
+    return {"histograms": drained, "counters": counter_items}
+
+def merge_metrics(metrics: Dict):
+    """Adds metrics drained in another process (e.g. an index worker) to this one's."""
+    for stage, (counts, count, total) in metrics["histograms"].items():
+        with metrics_lock:
+            histogram = stage_histograms.get(stage)
+            if histogram is None:
+                histogram = stage_histograms[stage] = Histogram()
+        histogram.merge(counts, count, total)
+    with metrics_lock:
+        counters.update(metrics["counters"])
+
+def render_metrics() -> str:
+    """Renders all histograms and counters in the Prometheus text exposition format."""
+    lines = ["# TYPE anveshak_stage_seconds histogram"]
+    with metrics_lock:
+        histograms = sorted(stage_histograms.items())
+        counter_items = sorted(counters.items())
+    for stage, histogram in histograms:
+        with histogram._lock:
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                lines.append(f'anveshak_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {count}')
+            lines.append(f'anveshak_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {histogram.count}')
+            lines.append(f'anveshak_stage_seconds_sum{{stage="{stage}"}} {histogram.sum}')
+            lines.append(f'anveshak_stage_seconds_count{{stage="{stage}"}} {histogram.count}')
+    for name, value in counter_items:
+        lines.append(f"# TYPE anveshak_{name}_total counter")
+        lines.append(f"anveshak_{name}_total {value}")
+    return "\n".join(lines) + "\n"
+
+class SamplingProfiler:
+    """
+    Periodically samples the stacks of all threads and aggregates them as
+    collapsed stacks (flame graph input). Can be started and stopped at runtime.
+    """
+    def __init__(self):
+        self.samples: Counter = Counter()
+        self.interval = 0.01
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, interval_ms: float = 10.0):
+        with self._lock:
+            if self.running:
+                return
+            self.interval = interval_ms / 1000.0
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        with self._lock:
+            self._stop.set()
+            if self._thread is not None:
+                self._thread.join()
+            self._thread = None
+
+    def reset(self):
+        with self._lock:
+            self.samples = Counter()
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                self.samples[";".join(reversed(stack))] += 1
+
+    def collapsed(self) -> str:
+        return "\n".join(f"{stack} {count}" for stack, count in self.samples.most_common()) + "\n"
+
+profiler = SamplingProfiler()
+
+@app.middleware("http")
+async def timing_middleware(request: Request, call_next):
+    """Collects a per-request stage breakdown and returns it as Server-Timing when asked for."""
+    timings: Dict[str, float] = {}
+    token = request_timings.set(timings)
+    start = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        request_timings.reset(token)
+    if request.headers.get(TIMING_REQUEST_HEADER):
+        timings["total"] = time.perf_counter() - start
+        response.headers["Server-Timing"] = ", ".join(f"{stage};dur={seconds * 1000:.2f}" for stage, seconds in timings.items())
+        response.headers["Timing-Allow-Origin"] = "*"
+    return response
+
 # ===================================================================
 # Data Models (Pydantic)
 # ===================================================================
@@ -60,6 +279,13 @@ class IngestRequest(BaseModel):
     tilesPerZoom: Dict[str, Dict[str, Union[List[int], int]]]
     minZoom: int
     maxZoom: int
+    buildPyramid: bool = False
+
+class ReindexRequest(BaseModel):
+    datasetId: Optional[str] = None
+    footprintId: Optional[str] = None
+    workers: Optional[int] = None
+    threadsPerWorker: Optional[int] = None
 
 class CancelRequest(BaseModel):
     datasetId: str
@@ -79,12 +305,22 @@ class SimilarRequest(BaseModel):
     footprint: str
     geojson: dict
 
+class SimilarQuery(BaseModel):
+    annotation_id: str
+    geojson: dict
+
+class SimilarBatchRequest(BaseModel):
+    dataset: str
+    footprint: str
+    queries: List[SimilarQuery]
+
 class SimilarMoreRequest(BaseModel):
     annotation_id: str
     dataset: str
     footprint: str
     geojson: dict
     exclude_zooms: List[int]
+    cursor: Optional[str] = None
 
 # ===================================================================
 # Feature Extraction (PyTorch & Timm)
@@ -93,38 +329,131 @@ class SimilarMoreRequest(BaseModel):
 device = "cpu"
 model_name = "efficientnet_b0"
 
+# CPU inference settings (env-overridable so indexing workers can pin their own threads)
+TORCH_NUM_THREADS = int(os.environ.get("ANVESHAK_TORCH_THREADS", os.cpu_count() or 1))
+TORCH_INTEROP_THREADS = int(os.environ.get("ANVESHAK_TORCH_INTEROP_THREADS", 1))
+FEATURE_TRUNK_TORCHSCRIPT = os.environ.get("ANVESHAK_TORCHSCRIPT", "1") == "1"
+FEATURE_PARITY_ATOL = 1e-3
+
+torch.set_num_threads(TORCH_NUM_THREADS)
+try:
+    torch.set_num_interop_threads(TORCH_INTEROP_THREADS)
+except RuntimeError:
+    # Inter-op pool was already started (e.g. module re-imported); keep existing setting
+    pass
+
 # Initialize model and transformations once on startup
 model = timm.create_model(model_name, pretrained=True)
 config = resolve_model_data_config(model)
 transform = create_transform(**config)
 model.eval().to(device)
 
-features = {}
+# Reference model calls register forward hooks on shared modules, so they are serialized
+model_lock = threading.Lock()
 
-def get_features_hook(name: str):
+def get_features_hook(features: Dict[str, torch.Tensor], name: str):
     """Creates a hook to capture layer features."""
     def hook(model, input, output):
         features[name] = output.detach()
     return hook
 
-# Register hooks for feature extraction
-handle3 = model.blocks[3].register_forward_hook(get_features_hook('blocks[3]'))
-handle5 = model.blocks[5].register_forward_hook(get_features_hook('blocks[5]'))
-
-def extract_features(image: Image.Image) -> np.ndarray:
-    """Extracts concatenated features from an image."""
-    rgb_image = image.convert("RGB")
-    img_t = transform(rgb_image).unsqueeze(0).to(device)
-    with torch.no_grad():
-        _ = model(img_t)
+class FeatureTrunk(nn.Module):
+    """
+    EfficientNet stem + blocks[0..5] only. Returns pooled blocks[3] and
+    blocks[5] activations concatenated; blocks[6], conv_head and the
+    classifier are never run.
+    """
+    def __init__(self, backbone: nn.Module):
+        super().__init__()
+        self.conv_stem = backbone.conv_stem
+        self.bn1 = backbone.bn1
+        self.blocks = nn.Sequential(*[backbone.blocks[i] for i in range(6)])
+        self.pool = nn.AdaptiveAvgPool2d((1, 1))
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        x = self.bn1(self.conv_stem(x))
+        x = self.blocks[:4](x)
+        pooled_b3 = self.pool(x).flatten(1)
+        x = self.blocks[4:](x)
+        pooled_b5 = self.pool(x).flatten(1)
+        return torch.cat((pooled_b3, pooled_b5), dim=1)
+
+def extract_features_reference(images: List[Image.Image]) -> np.ndarray:
+    """Runs the full eager model with hooks; used as the parity baseline for the trunk."""
+    batch_t = torch.stack([transform(image.convert("RGB")) for image in images]).to(device)
+    features = {}
+    with model_lock, torch.no_grad():
+        handle3 = model.blocks[3].register_forward_hook(get_features_hook(features, 'blocks[3]'))
+        handle5 = model.blocks[5].register_forward_hook(get_features_hook(features, 'blocks[5]'))
+        try:
+            _ = model(batch_t)
+        finally:
+            handle3.remove()
+            handle5.remove()
         features_b3 = features['blocks[3]']
         features_b5 = features['blocks[5]']
         pool = nn.AdaptiveAvgPool2d((1, 1))
-        pooled_b3 = pool(features_b3).squeeze().cpu().numpy()
-        pooled_b5 = pool(features_b5).squeeze().cpu().numpy()
-        concatenated_features = np.concatenate((pooled_b3, pooled_b5))
+        pooled_b3 = pool(features_b3).flatten(1).cpu().numpy()
+        pooled_b5 = pool(features_b5).flatten(1).cpu().numpy()
+        concatenated_features = np.concatenate((pooled_b3, pooled_b5), axis=1)
     return concatenated_features
 
+def run_trunk(trunk: nn.Module, images: List[Image.Image]) -> np.ndarray:
+    """Embeds a batch of images with the given trunk."""
+    batch_t = torch.stack([transform(image.convert("RGB")) for image in images]).to(device)
+    with torch.no_grad():
+        return trunk(batch_t).cpu().numpy()
+
+def check_feature_parity(images: List[Image.Image], atol: float = FEATURE_PARITY_ATOL, trunk: nn.Module = None) -> float:
+    """
+    Compares trunk embeddings (the live trunk by default) against the full
+    eager model and returns the max absolute difference. Raises ValueError
+    if it exceeds atol.
+    """
+    expected = extract_features_reference(images)
+    actual = run_trunk(trunk if trunk is not None else feature_trunk, images)
+    max_diff = float(np.max(np.abs(expected - actual)))
+    if max_diff > atol:
+        raise ValueError(f"Feature trunk diverges from reference model (max abs diff {max_diff:.2e} > {atol:.0e})")
+    return max_diff
+
+def build_feature_trunk() -> nn.Module:
+    """
+    Builds the truncated trunk, traced and frozen with TorchScript when
+    enabled. The traced trunk is only used if it passes the parity check,
+    so every process importing this module runs the same verified backend.
+    """
+    trunk = FeatureTrunk(model).eval().to(device)
+    if not FEATURE_TRUNK_TORCHSCRIPT:
+        return trunk
+    try:
+        example = torch.zeros((1, *config['input_size']), device=device)
+        with torch.no_grad():
+            traced = torch.jit.optimize_for_inference(torch.jit.trace(trunk, example))
+    except Exception as e:
+        print(f"TorchScript export of feature trunk failed, using eager trunk: {e}")
+        return trunk
+    parity_image = Image.fromarray(np.random.default_rng(0).integers(0, 256, (256, 256, 3), dtype=np.uint8))
+    try:
+        check_feature_parity([parity_image], trunk=traced)
+    except ValueError as e:
+        print(f"{e}. Using eager feature trunk.")
+        return trunk
+    return traced
+
+feature_trunk = build_feature_trunk()
+
+def extract_features_batch(images: List[Image.Image]) -> np.ndarray:
+    """Extracts concatenated features for a batch of images in one forward pass."""
+    with timed("extract_features"):
+        embeddings = run_trunk(feature_trunk, images)
+    increment("embeddings", len(images))
+    return embeddings
+
+def extract_features(image: Image.Image) -> np.ndarray:
+    """Extracts concatenated features from an image."""
+    return extract_features_batch([image])[0]
+
 # ===================================================================
 # Faiss Indexing
 # ===================================================================
@@ -135,6 +464,7 @@ class FaissIndex:
         self.d = d
         self.index = None
         self.tile_map = []
+        self.skipped_tiles = []
         self.embeddings = None
 
     def build_index(self, embeddings, tile_info):
@@ -146,40 +476,166 @@ class FaissIndex:
         self.embeddings = embeddings_np
 
     def search(self, query_embedding: np.ndarray, k: int):
-        query_embedding_np = np.array([query_embedding], dtype="float32")
-        faiss.normalize_L2(query_embedding_np)
-        distances, indices = self.index.search(query_embedding_np, k)
-
-        results = []
-        for i in range(len(indices[0])):
-            idx = indices[0][i]
-            if idx == -1:
-                continue
-            tile_info = self.tile_map[idx]
-            score = distances[0][i]
-            results.append({
-                "dataset": tile_info[0],
-                "footprint": tile_info[1],
-                "z": tile_info[2],
-                "x": tile_info[3],
-                "y": tile_info[4],
-                "score": float(score),
-            })
-        return results
-
-def save_faiss_index(faiss_index: FaissIndex, name: str, zoom: int):
-    """Saves a Faiss index and its metadata to disk."""
-    index_file = os.path.join(FAISS_INDEX_ROOT, f"{name}_{zoom}.index")
-    tile_map_file = os.path.join(TILE_MAP_ROOT, f"{name}_{zoom}.json")
-    embeddings_file = os.path.join(EMBEDDINGS_ROOT, f"{name}_{zoom}.npy")
-    faiss.write_index(faiss_index.index, index_file)
-    with open(tile_map_file, "w") as f:
-        json.dump(faiss_index.tile_map, f)
-    if faiss_index.embeddings is not None:
-        np.save(embeddings_file, faiss_index.embeddings)
+        return self.search_batch(np.array([query_embedding]), k)[0]
+
+    def search_batch(self, query_embeddings: np.ndarray, k: int):
+        """Searches several query vectors at once (nq > 1); returns one result list per query."""
+        query_embeddings_np = np.array(query_embeddings, dtype="float32")
+        faiss.normalize_L2(query_embeddings_np)
+        with timed("faiss_search"):
+            distances, indices = self.index.search(query_embeddings_np, k)
+        increment("faiss_queries", len(query_embeddings_np))
+
+        with timed("result_assembly"):
+            return self._assemble_results(distances, indices)
+
+    def _assemble_results(self, distances: np.ndarray, indices: np.ndarray):
+        all_results = []
+        for q in range(len(indices)):
+            results = []
+            for i in range(len(indices[q])):
+                idx = indices[q][i]
+                if idx == -1:
+                    continue
+                tile_info = self.tile_map[idx]
+                score = distances[q][i]
+                results.append({
+                    "dataset": tile_info[0],
+                    "footprint": tile_info[1],
+                    "z": tile_info[2],
+                    "x": tile_info[3],
+                    "y": tile_info[4],
+                    "score": float(score),
+                })
+            all_results.append(results)
+        return all_results
+
+def atomic_write(path: str, write_fn):
+    """Writes a file via `write_fn(tmp_path)` and renames it into place."""
+    tmp_path = f"{path}.{os.getpid()}-{threading.get_ident()}-{uuid.uuid4().hex}.tmp"
+    try:
+        write_fn(tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def fsync_path(path: str):
+    """Flushes a file or directory to disk."""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def file_sha256(path: str) -> str:
+    """Computes the SHA-256 checksum of a file."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def get_bundle_dir(name: str, zoom: int) -> str:
+    """Directory holding all versions of an index bundle."""
+    return os.path.join(INDEX_BUNDLE_ROOT, f"{name}_{zoom}")
+
+def list_bundle_versions(bundle_dir: str) -> List[str]:
+    """Lists complete bundle versions, newest first."""
+    if not os.path.isdir(bundle_dir):
+        return []
+    versions = [v for v in os.listdir(bundle_dir) if v.startswith("v") and os.path.isdir(os.path.join(bundle_dir, v))]
+    return sorted(versions, key=lambda v: int(v[1:]) if v[1:].isdigit() else -1, reverse=True)
 
-def load_faiss_index(name: str, zoom: int) -> Union[FaissIndex, None]:
-    """Loads a Faiss index and its metadata from disk."""
+def save_faiss_index(faiss_index: FaissIndex, name: str, zoom: int) -> str:
+    """
+    Saves a Faiss index and its metadata as a new versioned bundle.
+    Files are written into a temp directory, fsynced, renamed into place and
+    only then published through the bundle's CURRENT pointer.
+    """
+    bundle_dir = get_bundle_dir(name, zoom)
+    os.makedirs(bundle_dir, exist_ok=True)
+    version = f"v{time.time_ns()}"
+    tmp_dir = os.path.join(bundle_dir, f".tmp-{os.getpid()}-{version}")
+    os.makedirs(tmp_dir)
+    try:
+        faiss.write_index(faiss_index.index, os.path.join(tmp_dir, "index.faiss"))
+        with open(os.path.join(tmp_dir, "tile_map.json"), "w") as f:
+            json.dump({"tiles": faiss_index.tile_map, "skipped": faiss_index.skipped_tiles}, f)
+        files = ["index.faiss", "tile_map.json"]
+        if faiss_index.embeddings is not None:
+            with open(os.path.join(tmp_dir, "embeddings.npy"), "wb") as f:
+                np.save(f, faiss_index.embeddings)
+            files.append("embeddings.npy")
+        for file in files:
+            fsync_path(os.path.join(tmp_dir, file))
+
+        manifest = {
+            "name": name,
+            "zoom": zoom,
+            "version": version,
+            "model": model_name,
+            "dim": faiss_index.d,
+            "vectors": int(faiss_index.index.ntotal),
+            "skippedTiles": len(faiss_index.skipped_tiles),
+            "checksums": {file: file_sha256(os.path.join(tmp_dir, file)) for file in files},
+            "createdAt": time.time(),
+        }
+        with open(os.path.join(tmp_dir, "manifest.json"), "w") as f:
+            json.dump(manifest, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        fsync_path(tmp_dir)
+
+        os.rename(tmp_dir, os.path.join(bundle_dir, version))
+    except Exception:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+    def write_pointer(tmp_path):
+        with open(tmp_path, "w") as f:
+            f.write(version)
+            f.flush()
+            os.fsync(f.fileno())
+
+    atomic_write(os.path.join(bundle_dir, "CURRENT"), write_pointer)
+    fsync_path(bundle_dir)
+
+    for old_version in list_bundle_versions(bundle_dir)[INDEX_BUNDLE_KEEP_VERSIONS:]:
+        shutil.rmtree(os.path.join(bundle_dir, old_version), ignore_errors=True)
+    return version
+
+def load_index_bundle(version_dir: str) -> FaissIndex:
+    """Loads one bundle version, verifying it against its manifest. Raises ValueError if inconsistent."""
+    with open(os.path.join(version_dir, "manifest.json"), "r") as f:
+        manifest = json.load(f)
+    if manifest.get("model") != model_name:
+        raise ValueError(f"built with model '{manifest.get('model')}', expected '{model_name}'")
+    for file, checksum in manifest["checksums"].items():
+        if file_sha256(os.path.join(version_dir, file)) != checksum:
+            raise ValueError(f"checksum mismatch for {file}")
+
+    index = faiss.read_index(os.path.join(version_dir, "index.faiss"))
+    with open(os.path.join(version_dir, "tile_map.json"), "r") as f:
+        tile_map = json.load(f)
+    skipped_tiles = []
+    if isinstance(tile_map, dict):
+        tile_map, skipped_tiles = tile_map["tiles"], tile_map.get("skipped", [])
+    embeddings_file = os.path.join(version_dir, "embeddings.npy")
+    embeddings = np.load(embeddings_file) if os.path.exists(embeddings_file) else None
+    vectors = manifest["vectors"]
+    if index.ntotal != vectors or len(tile_map) != vectors or (embeddings is not None and len(embeddings) != vectors):
+        raise ValueError("vector count does not match manifest")
+
+    fi = FaissIndex(index.d)
+    fi.index = index
+    fi.tile_map = [tuple(x) for x in tile_map]
+    fi.skipped_tiles = skipped_tiles
+    fi.embeddings = embeddings
+    return fi
+
+def load_legacy_faiss_index(name: str, zoom: int) -> Union[FaissIndex, None]:
+    """Loads an index saved as loose files in the pre-bundle layout."""
     index_file = os.path.join(FAISS_INDEX_ROOT, f"{name}_{zoom}.index")
     tile_map_file = os.path.join(TILE_MAP_ROOT, f"{name}_{zoom}.json")
     embeddings_file = os.path.join(EMBEDDINGS_ROOT, f"{name}_{zoom}.npy")
@@ -199,12 +655,150 @@ def load_faiss_index(name: str, zoom: int) -> Union[FaissIndex, None]:
             return None
     return None
 
-def build_faiss_index_for_footprint_zoom(dataset_id: str, footprint_id: str, zoom: int):
+def load_faiss_index(name: str, zoom: int) -> Union[FaissIndex, None]:
+    """
+    Loads a Faiss index and its metadata from disk. The CURRENT bundle
+    version is tried first, then older intact versions, then the legacy layout.
+    """
+    bundle_dir = get_bundle_dir(name, zoom)
+    versions = list_bundle_versions(bundle_dir)
+    pointer_file = os.path.join(bundle_dir, "CURRENT")
+    if os.path.exists(pointer_file):
+        with open(pointer_file, "r") as f:
+            current = f.read().strip()
+        if current in versions:
+            versions.remove(current)
+            versions.insert(0, current)
+
+    for version in versions:
+        try:
+            return load_index_bundle(os.path.join(bundle_dir, version))
+        except Exception as e:
+            print(f"Skipping index bundle {name}_{zoom}/{version}: {e}")
+    return load_legacy_faiss_index(name, zoom)
+
+def pid_alive(pid: int) -> bool:
+    """Checks whether a process with this pid exists."""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def remove_stale_bundle_temp_dirs():
+    """
+    Removes temp directories left behind by saves interrupted by a crash.
+    Directories whose writer (the pid in `.tmp-<pid>-...`) is still running
+    are kept, e.g. those of a concurrent `backend.reindex`, unless very old.
+    """
+    now = time.time()
+    for bundle in os.listdir(INDEX_BUNDLE_ROOT):
+        bundle_dir = os.path.join(INDEX_BUNDLE_ROOT, bundle)
+        if not os.path.isdir(bundle_dir): continue
+        for entry in os.listdir(bundle_dir):
+            if not entry.startswith(".tmp-"): continue
+            tmp_dir = os.path.join(bundle_dir, entry)
+            pid_str = entry[len(".tmp-"):].split("-", 1)[0]
+            try:
+                age = now - os.path.getmtime(tmp_dir)
+            except OSError:
+                continue
+            writer_alive = pid_str.isdigit() and int(pid_str) != os.getpid() and pid_alive(int(pid_str))
+            if not writer_alive or age > INDEX_BUNDLE_TEMP_MAX_AGE_SECONDS:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+
+# ===================================================================
+# Live Index Registry
+# ===================================================================
+
+class ReadWriteLock:
+    """Allows many concurrent readers or one writer; waiting writers block new readers."""
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writer = False
+        self._waiting_writers = 0
+
+    @contextmanager
+    def read(self):
+        with self._cond:
+            while self._writer or self._waiting_writers:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def write(self):
+        with self._cond:
+            self._waiting_writers += 1
+            while self._writer or self._readers:
+                self._cond.wait()
+            self._waiting_writers -= 1
+            self._writer = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writer = False
+                self._cond.notify_all()
+
+# Guards the registry dict: lookups and snapshots hold the read side, swaps
+# the write side. Searches run outside the lock; that is safe because a
+# published FaissIndex is never mutated, so an in-flight search keeps using
+# the complete index it looked up even if a newer one is swapped in.
+faiss_indexes_lock = ReadWriteLock()
+
+def get_faiss_index(index_key: tuple) -> Union[FaissIndex, None]:
+    """Returns the live index for (dataset, footprint, zoom), if loaded."""
+    with faiss_indexes_lock.read():
+        return faiss_indexes.get(index_key)
+
+def swap_faiss_index(index_key: tuple, fi: FaissIndex):
+    """Publishes a fully loaded index; searches already running finish on the previous one."""
+    with faiss_indexes_lock.write():
+        faiss_indexes[index_key] = fi
+
+def faiss_index_snapshot() -> List[Tuple[tuple, FaissIndex]]:
+    """Returns a consistent copy of the live (key, index) pairs."""
+    with faiss_indexes_lock.read():
+        return list(faiss_indexes.items())
+
+def tile_perceptual_hash(gray: Image.Image) -> int:
+    """64-bit difference hash (dHash) of a grayscale tile."""
+    pixels = np.asarray(gray.resize((9, 8), Image.BILINEAR), dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+    return int(sum(1 << i for i, bit in enumerate(bits) if bit))
+
+def classify_tile(img: Image.Image) -> Tuple[Union[str, None], Image.Image]:
+    """
+    Cheap pixel-statistics check run before embedding. Returns a skip reason
+    ("transparent", "nodata" or "uniform") or None, plus the RGB tile.
+    """
+    if img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info):
+        alpha = np.asarray(img.convert("RGBA").getchannel("A"))
+        if np.mean(alpha == 0) >= NODATA_FRACTION_THRESHOLD:
+            return "transparent", img.convert("RGB")
+    rgb = img.convert("RGB")
+    gray = np.asarray(rgb.convert("L"), dtype=np.float32)
+    if np.mean(gray == 0) >= NODATA_FRACTION_THRESHOLD:
+        return "nodata", rgb
+    if gray.std() < BLANK_TILE_STD_THRESHOLD:
+        return "uniform", rgb
+    return None, rgb
+
+def build_faiss_index_for_footprint_zoom(dataset_id: str, footprint_id: str, zoom: int) -> Union[FaissIndex, None]:
     """
     Builds and loads an in-memory Faiss index for a specific
     dataset, footprint, and zoom level.
     """
-    global faiss_indexes
     zoom_path = os.path.join(TILES_ROOT, dataset_id, footprint_id, str(zoom))
     if not os.path.isdir(zoom_path):
         print(f"Zoom directory not found: {zoom_path}")
@@ -212,30 +806,221 @@ def build_faiss_index_for_footprint_zoom(dataset_id: str, footprint_id: str, zoo
         
     all_embeddings = []
     all_tile_info = []
+    skipped_tiles = []
+    seen_hashes: Dict[int, Tuple[int, int]] = {}
+    # Duplicates of tiles still waiting to be embedded, resolved once that tile's outcome is known
+    held_duplicates: Dict[int, List[Tuple[int, int, str]]] = {}
+    pending_images, pending_info, pending_hashes = [], [], []
+
+    def queue_tile(img: Image.Image, x: int, y: int, tile_hash: Union[int, None]):
+        pending_images.append(img)
+        pending_info.append((dataset_id, footprint_id, zoom, x, y))
+        pending_hashes.append(tile_hash)
+        if tile_hash is not None:
+            seen_hashes[tile_hash] = (x, y)
+            held_duplicates[tile_hash] = []
+
+    def readmit_duplicates(tile_hash: int, duplicates: List[Tuple[int, int, str]]):
+        """Queues the first readable duplicate in place of a tile that failed to embed."""
+        del seen_hashes[tile_hash]
+        for i, (x, y, tile_path) in enumerate(duplicates):
+            try:
+                with Image.open(tile_path) as raw:
+                    img = raw.convert("RGB")
+            except Exception as e:
+                increment("tiles_failed")
+                print(f"Warning: Could not process tile {tile_path}. {e}")
+                continue
+            queue_tile(img, x, y, tile_hash)
+            held_duplicates[tile_hash] = duplicates[i + 1:]
+            return
+
+    def embed_pending():
+        if not pending_images:
+            return
+        batch = list(zip(pending_images, pending_info, pending_hashes))
+        pending_images.clear()
+        pending_info.clear()
+        pending_hashes.clear()
+        try:
+            embeddings = list(extract_features_batch([img for img, _, _ in batch]))
+        except Exception:
+            # Retry one by one so a single bad tile doesn't drop the whole batch
+            embeddings = []
+            for img, tile_info, _ in batch:
+                try:
+                    embeddings.append(extract_features(img))
+                except Exception as e:
+                    embeddings.append(None)
+                    increment("tiles_failed")
+                    print(f"Warning: Could not embed tile {tile_info[2]}/{tile_info[3]}/{tile_info[4]}. {e}")
+        for (_, tile_info, tile_hash), embedding in zip(batch, embeddings):
+            if embedding is not None:
+                all_embeddings.append(embedding)
+                all_tile_info.append(tile_info)
+            if tile_hash is None:
+                continue
+            duplicates = held_duplicates.pop(tile_hash)
+            if embedding is None:
+                # Its duplicates would point at a tile missing from the index
+                readmit_duplicates(tile_hash, duplicates)
+                continue
+            for x, y, _ in duplicates:
+                skipped_tiles.append({"x": x, "y": y, "reason": "duplicate", "duplicateOf": [tile_info[3], tile_info[4]]})
 
-    for x_str in os.listdir(zoom_path):
+    for x_str in sorted(os.listdir(zoom_path), key=lambda v: int(v) if v.isdigit() else -1):
         x_path = os.path.join(zoom_path, x_str)
         if not os.path.isdir(x_path): continue
-        for y_file in os.listdir(x_path):
+        for y_file in sorted(os.listdir(x_path)):
             try:
                 tile_path = os.path.join(x_path, y_file)
-                img = Image.open(tile_path).convert("RGB")
-                emb = extract_features(img)
-                all_embeddings.append(emb)
                 y = int(y_file.split('.')[0])
                 x = int(x_str)
-                all_tile_info.append((dataset_id, footprint_id, zoom, x, y))
+                with Image.open(tile_path) as raw:
+                    with timed("tile_decode"):
+                        raw.load()
+                    with timed("tile_prefilter"):
+                        reason, img = classify_tile(raw)
+                if reason is not None:
+                    skipped_tiles.append({"x": x, "y": y, "reason": reason})
+                    continue
+                tile_hash = None
+                if DEDUPE_TILES:
+                    tile_hash = tile_perceptual_hash(img.convert("L"))
+                    if tile_hash in held_duplicates:
+                        held_duplicates[tile_hash].append((x, y, tile_path))
+                        continue
+                    if tile_hash in seen_hashes:
+                        skipped_tiles.append({"x": x, "y": y, "reason": "duplicate", "duplicateOf": list(seen_hashes[tile_hash])})
+                        continue
+                queue_tile(img, x, y, tile_hash)
             except Exception as e:
+                increment("tiles_failed")
                 print(f"Warning: Could not process tile {tile_path}. {e}")
+            if len(pending_images) >= INDEX_EMBED_BATCH_SIZE:
+                embed_pending()
+    # Re-admitted duplicates can queue new tiles while the last batch is embedded
+    while pending_images:
+        embed_pending()
+    increment("tiles_skipped", len(skipped_tiles))
     
     if all_embeddings:
         d = all_embeddings[0].shape[0]
         fi = FaissIndex(d)
         fi.build_index(all_embeddings, all_tile_info)
+        fi.skipped_tiles = skipped_tiles
         index_name = f"{dataset_id}_{footprint_id}"
         save_faiss_index(fi, index_name, zoom)
-        faiss_indexes[(dataset_id, footprint_id, zoom)] = fi
-        print(f"Index built & saved for '{index_name}' zoom {zoom} with {len(all_embeddings)} vectors ✅")
+        swap_faiss_index((dataset_id, footprint_id, zoom), fi)
+        increment("tiles_indexed", len(all_embeddings))
+        print(f"Index built & saved for '{index_name}' zoom {zoom} with {len(all_embeddings)} vectors "
+              f"({len(skipped_tiles)} blank/duplicate tiles skipped) ✅")
+        return fi
+    return None
+
+# ===================================================================
+# Parallel Indexing
+# ===================================================================
+
+# Held for a pool's lifetime: concurrent rebuilds neither race on the child environment
+# nor run two CPU-sized pools at once
+index_pool_lock = threading.Lock()
+
+def _index_worker(task: Tuple[str, str, int]) -> Tuple[int, Dict]:
+    """
+    Builds and saves one footprint/zoom index inside a worker; returns its
+    vector count and the metrics recorded while building it.
+    """
+    # Drop anything recorded before this task (import-time parity check, earlier tasks)
+    drain_metrics()
+    fi = build_faiss_index_for_footprint_zoom(*task)
+    return (fi.index.ntotal if fi else 0), drain_metrics()
+
+@contextmanager
+def child_torch_threads(num_threads: int):
+    """
+    Sets the thread env vars read at import time, so spawned workers pin their
+    thread pools before the model is loaded and traced.
+    """
+    overrides = {"ANVESHAK_TORCH_THREADS": str(num_threads), "ANVESHAK_TORCH_INTEROP_THREADS": "1"}
+    previous = {key: os.environ.get(key) for key in overrides}
+    os.environ.update(overrides)
+    try:
+        yield
+    finally:
+        for key, value in previous.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+
+def build_faiss_indexes_parallel(tasks: List[Tuple[str, str, int]], workers: int = None,
+                                 threads_per_worker: int = None) -> Dict[tuple, int]:
+    """
+    Builds indexes for (dataset, footprint, zoom) tasks across a process pool.
+    Each worker imports this module (loading the model once) and is pinned to
+    `threads_per_worker` torch threads; both values are clamped so that
+    workers * threads <= CPU count. Built indexes are loaded back from disk
+    into `faiss_indexes`. A single unpinned worker builds in-process with the
+    server's own thread settings.
+    """
+    tasks = list(tasks)
+    cpu_count = os.cpu_count() or 1
+    pinned = threads_per_worker is not None
+    if workers is None:
+        workers = max(1, cpu_count // (threads_per_worker or INDEX_THREADS_PER_WORKER))
+    workers = max(1, min(workers, len(tasks), cpu_count))
+    max_threads = max(1, cpu_count // workers)
+    threads_per_worker = max_threads if threads_per_worker is None else max(1, min(threads_per_worker, max_threads))
+
+    built: Dict[tuple, int] = {}
+    if workers == 1 and not pinned:
+        # torch.set_num_threads is process-wide, so the serving process never changes it;
+        # pinned builds always go to a worker process instead
+        for task in tasks:
+            fi = build_faiss_index_for_footprint_zoom(*task)
+            if fi:
+                built[task] = fi.index.ntotal
+        return built
+
+    print(f"Building {len(tasks)} indexes with {workers} workers x {threads_per_worker} threads...")
+    # Forking a process with live torch thread pools is unsafe, so workers are spawned
+    mp_context = multiprocessing.get_context("spawn")
+    with index_pool_lock, child_torch_threads(threads_per_worker), \
+            ProcessPoolExecutor(max_workers=workers, mp_context=mp_context) as pool:
+        futures = {pool.submit(_index_worker, task): task for task in tasks}
+        for future in as_completed(futures):
+            task = futures[future]
+            dataset_id, footprint_id, zoom = task
+            try:
+                ntotal, worker_metrics = future.result()
+            except Exception as e:
+                print(f"Warning: Indexing failed for '{dataset_id}_{footprint_id}' zoom {zoom}. {e}")
+                continue
+            merge_metrics(worker_metrics)
+            if not ntotal:
+                continue
+            fi = load_faiss_index(f"{dataset_id}_{footprint_id}", zoom)
+            if fi:
+                swap_faiss_index(task, fi)
+                built[task] = ntotal
+    return built
+
+def discover_footprint_zooms(dataset_id: str = None, footprint_id: str = None) -> List[Tuple[str, str, int]]:
+    """Lists (dataset, footprint, zoom) triples that have tiles on disk, optionally filtered."""
+    found = []
+    if not os.path.isdir(TILES_ROOT):
+        return found
+    for ds in sorted(os.listdir(TILES_ROOT)):
+        dataset_path = os.path.join(TILES_ROOT, ds)
+        if not os.path.isdir(dataset_path) or (dataset_id and ds != dataset_id): continue
+        for fp in sorted(os.listdir(dataset_path)):
+            footprint_path = os.path.join(dataset_path, fp)
+            if not os.path.isdir(footprint_path) or (footprint_id and fp != footprint_id): continue
+            for zoom_str in os.listdir(footprint_path):
+                if not os.path.isdir(os.path.join(footprint_path, zoom_str)) or not zoom_str.isdigit(): continue
+                found.append((ds, fp, int(zoom_str)))
+    return found
 
 # ===================================================================
 # Helper Classes and Functions
@@ -290,6 +1075,45 @@ def latlng_to_tilexy(lat: float, lng: float, zoom: int):
     y = int((1.0 - math.log(math.tan(math.radians(lat)) + 1 / math.cos(math.radians(lat))) / math.pi) / 2.0 * n)
     return x, y
 
+def stitch_query_image(dataset: str, footprint: str, geojson: dict, zoom: int, not_found_detail: str) -> Image.Image:
+    """Crops and stitches the tiles under a feature into a padded model input image."""
+    with timed("crop_stitch"):
+        return _stitch_query_image(dataset, footprint, geojson, zoom, not_found_detail)
+
+def _stitch_query_image(dataset: str, footprint: str, geojson: dict, zoom: int, not_found_detail: str) -> Image.Image:
+    feature_shape = shape(geojson['geometry'])
+    min_lng, min_lat, max_lng, max_lat = feature_shape.bounds
+    min_tx, min_ty = latlng_to_tilexy(max_lat, min_lng, zoom)
+    max_tx, max_ty = latlng_to_tilexy(min_lat, max_lng, zoom)
+
+    cropped_pieces = []
+    for tx in range(min_tx, max_tx + 1):
+        for ty in range(min_ty, max_ty + 1):
+            tile_path = os.path.join(TILES_ROOT, dataset, footprint, str(zoom), str(tx), f"{ty}.png")
+            if not os.path.exists(tile_path): continue
+            bbox = projection.get_pixel_bbox_on_tile(geojson, zoom, tx, ty)
+            if bbox is None: continue
+            tile_img = Image.open(tile_path)
+            cropped_piece = tile_img.crop(bbox)
+            relative_x, relative_y = (tx - min_tx) * 256, (ty - min_ty) * 256
+            cropped_pieces.append({"image": cropped_piece, "paste_x": relative_x + bbox[0], "paste_y": relative_y + bbox[1]})
+
+    if not cropped_pieces:
+        raise HTTPException(status_code=404, detail=not_found_detail)
+
+    min_paste_x = min(p['paste_x'] for p in cropped_pieces)
+    min_paste_y = min(p['paste_y'] for p in cropped_pieces)
+    max_paste_x = max(p['paste_x'] + p['image'].width for p in cropped_pieces)
+    max_paste_y = max(p['paste_y'] + p['image'].height for p in cropped_pieces)
+    composite_width, composite_height = max_paste_x - min_paste_x, max_paste_y - min_paste_y
+    if composite_width <= 0 or composite_height <= 0:
+        raise HTTPException(status_code=400, detail="Composite image has invalid dimensions.")
+    composite_img = Image.new("RGB", (composite_width, composite_height))
+    for p in cropped_pieces:
+        composite_img.paste(p['image'], (p['paste_x'] - min_paste_x, p['paste_y'] - min_paste_y))
+    model_input_size = config['input_size'][1:]
+    return ImageOps.pad(composite_img, model_input_size, color='gray')
+
 def get_annotation_path(dataset: str, footprint: str) -> str:
     """Generates the file path for a specific footprint's annotations."""
     return os.path.join(ANNOTATIONS_DIR, dataset, f"{footprint}.json")
@@ -300,7 +1124,7 @@ def load_annotations(dataset: str, footprint: str) -> List[Dict]:
     if not os.path.exists(filepath):
         return []
     try:
-        with open(filepath, "r") as f:
+        with timed("annotation_load"), open(filepath, "r") as f:
             return json.load(f)
     except (json.JSONDecodeError, IOError):
         return []
@@ -309,20 +1133,86 @@ def save_annotations(dataset: str, footprint: str, data: List[Dict]):
     """Saves annotations for a specific dataset and footprint."""
     filepath = get_annotation_path(dataset, footprint)
     os.makedirs(os.path.dirname(filepath), exist_ok=True)
-    with open(filepath, "w") as f:
+    with timed("annotation_save"), open(filepath, "w") as f:
         json.dump(data, f, indent=2)
 
 def download_tile(session, url: str, path: str) -> bool:
     """Downloads a single tile from a URL and saves it."""
     try:
-        response = session.get(url, timeout=10)
-        response.raise_for_status()
+        with timed("tile_fetch"):
+            response = session.get(url, timeout=10)
+            response.raise_for_status()
         os.makedirs(os.path.dirname(path), exist_ok=True)
         with open(path, 'wb') as f:
             f.write(response.content)
+        increment("tiles_downloaded")
+        increment("tile_bytes_downloaded", len(response.content))
         return True
     except requests.exceptions.RequestException:
+        increment("tile_download_failures")
+        return False
+
+def build_parent_tile(child_zoom_path: str, parent_zoom_path: str, px: int, py: int) -> bool:
+    """Builds one 256x256 tile by downsampling its 2x2 children; missing children stay transparent."""
+    canvas = None
+    for dx in (0, 1):
+        for dy in (0, 1):
+            child_path = os.path.join(child_zoom_path, str(2 * px + dx), f"{2 * py + dy}.png")
+            if not os.path.exists(child_path): continue
+            try:
+                with Image.open(child_path) as child:
+                    if canvas is None:
+                        canvas = Image.new("RGBA", (512, 512), (0, 0, 0, 0))
+                    child_rgba = child.convert("RGBA")
+                    if child_rgba.size != (256, 256):
+                        child_rgba = child_rgba.resize((256, 256))
+                    canvas.paste(child_rgba, (dx * 256, dy * 256))
+            except OSError as e:
+                print(f"Warning: Could not read child tile {child_path}. {e}")
+    if canvas is None:
         return False
+    parent_path = os.path.join(parent_zoom_path, str(px), f"{py}.png")
+    os.makedirs(os.path.dirname(parent_path), exist_ok=True)
+    canvas.resize((256, 256), Image.BOX).save(parent_path)
+    return True
+
+def build_pyramid(dataset_id: str, footprint_id: str, finest_zoom: int, min_zoom: int, job_key: str = None) -> List[int]:
+    """
+    Derives zoom levels finest_zoom-1 .. min_zoom from the tiles already on
+    disk, writing each level's tiles in parallel. Returns the zooms built.
+    """
+    footprint_path = os.path.join(TILES_ROOT, dataset_id, footprint_id)
+    built_zooms = []
+    with ThreadPoolExecutor(max_workers=PYRAMID_WORKERS) as pool:
+        for z in range(finest_zoom - 1, min_zoom - 1, -1):
+            if job_key and ingestion_jobs.get(job_key, {}).get("cancelled"):
+                print(f"Pyramid generation cancelled at zoom {z}")
+                break
+            child_zoom_path = os.path.join(footprint_path, str(z + 1))
+            parent_zoom_path = os.path.join(footprint_path, str(z))
+            if not os.path.isdir(child_zoom_path):
+                break
+            parents = set()
+            for x_str in os.listdir(child_zoom_path):
+                x_path = os.path.join(child_zoom_path, x_str)
+                if not x_str.isdigit() or not os.path.isdir(x_path): continue
+                for y_file in os.listdir(x_path):
+                    y_str = os.path.splitext(y_file)[0]
+                    if y_file.endswith(".png") and y_str.isdigit():
+                        parents.add((int(x_str) // 2, int(y_str) // 2))
+            if not parents:
+                break
+            with timed("pyramid_level"):
+                results = list(pool.map(lambda tile: build_parent_tile(child_zoom_path, parent_zoom_path, *tile), sorted(parents)))
+            tiles_written = sum(results)
+            if not tiles_written:
+                # Nothing readable at z + 1, so no coarser level can be derived either
+                print(f"No tiles could be built for zoom {z}; stopping pyramid generation")
+                break
+            increment("pyramid_tiles_built", tiles_written)
+            print(f"Built zoom {z} locally from zoom {z + 1}: {tiles_written} tiles")
+            built_zooms.append(z)
+    return built_zooms
 
 def ingest_dataset(dataset_id: str, req: IngestRequest):
     """
@@ -335,8 +1225,14 @@ def ingest_dataset(dataset_id: str, req: IngestRequest):
     session = requests.Session()
     
     successfully_downloaded_zooms = []
+    requested_zooms = [z for z in range(req.minZoom, req.maxZoom + 1) if str(z) in req.tilesPerZoom]
+    if req.buildPyramid and requested_zooms:
+        # Only the finest zoom comes from the network; coarser ones are derived locally
+        download_zooms = [max(requested_zooms)]
+    else:
+        download_zooms = range(req.minZoom, req.maxZoom + 1)
     
-    for z in range(req.minZoom, req.maxZoom + 1):
+    for z in download_zooms:
         zoom_path = os.path.join(TILES_ROOT, dataset_id, req.footprintId, str(z))
         os.makedirs(zoom_path, exist_ok=True)
         if ingestion_jobs[job_key]["cancelled"]:
@@ -372,42 +1268,301 @@ def ingest_dataset(dataset_id: str, req: IngestRequest):
         if all_tiles_downloaded:
             successfully_downloaded_zooms.append(z)
 
+    if req.buildPyramid and successfully_downloaded_zooms:
+        finest_zoom = successfully_downloaded_zooms[0]
+        successfully_downloaded_zooms += build_pyramid(dataset_id, req.footprintId, finest_zoom, req.minZoom, job_key)
+
     ingestion_jobs.pop(job_key, None)
     
     if successfully_downloaded_zooms:
-        for zoom in successfully_downloaded_zooms:
-            build_faiss_index_for_footprint_zoom(dataset_id, req.footprintId, zoom)
+        build_faiss_indexes_parallel([(dataset_id, req.footprintId, zoom) for zoom in successfully_downloaded_zooms])
     
     print(f"Ingestion finished or cancelled for dataset: {dataset_id}/{req.footprintId}")
 
+# ===================================================================
+# Similarity Query Batching
+# ===================================================================
+
+class SimilarQueryBatcher:
+    """
+    Coalesces concurrent single similarity queries into one batched
+    `extract_features_batch` pass and one `search_batch` per index.
+    """
+    def __init__(self, window_ms: float, max_size: int):
+        self.window = window_ms / 1000.0
+        self.max_size = max_size
+        self._pending = []
+        self._cond = threading.Condition()
+        self._worker = None
+
+    def submit(self, image: Image.Image, faiss_index: Union[FaissIndex, None], k: int) -> Future:
+        """
+        Queues a query; the future resolves to (embedding, results).
+        With no index only the embedding is computed and results is empty.
+        """
+        future = Future()
+        with self._cond:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name="similar-query-batcher", daemon=True)
+                self._worker.start()
+            self._pending.append((image, faiss_index, k, future, request_timings.get(), time.perf_counter()))
+            self._cond.notify()
+        return future
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                # Hold the batch open for a short window so concurrent queries can join it
+                deadline = time.monotonic() + self.window
+                while len(self._pending) < self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch = self._pending[:self.max_size]
+                self._pending = self._pending[self.max_size:]
+            self._process(batch)
+
+    def _process(self, batch: List[Tuple]):
+        # Stage times are attributed to every request that shared the batch
+        start = time.perf_counter()
+        for item in batch:
+            observe_stage("batch_wait", start - item[5], item[4])
+        try:
+            embeddings = extract_features_batch([item[0] for item in batch])
+        except Exception as e:
+            for item in batch:
+                item[3].set_exception(e)
+            return
+        embed_seconds = time.perf_counter() - start
+        for item in batch:
+            if item[4] is not None:
+                item[4]["extract_features"] = item[4].get("extract_features", 0.0) + embed_seconds
+        increment("similar_batches")
+        increment("similar_batched_queries", len(batch))
+
+        groups: Dict[int, Tuple] = {}
+        for i, item in enumerate(batch):
+            faiss_index = item[1]
+            groups.setdefault(id(faiss_index), (faiss_index, []))[1].append(i)
+
+        for faiss_index, positions in groups.values():
+            if faiss_index is None:
+                for i in positions:
+                    batch[i][3].set_result((embeddings[i], []))
+                continue
+            k = max(batch[i][2] for i in positions)
+            search_start = time.perf_counter()
+            try:
+                batch_results = faiss_index.search_batch(embeddings[positions], k)
+            except Exception as e:
+                for i in positions:
+                    batch[i][3].set_exception(e)
+                continue
+            search_seconds = time.perf_counter() - search_start
+            for i in positions:
+                if batch[i][4] is not None:
+                    batch[i][4]["faiss_search"] = batch[i][4].get("faiss_search", 0.0) + search_seconds
+            for i, results in zip(positions, batch_results):
+                batch[i][3].set_result((embeddings[i], results[:batch[i][2]]))
+
+similar_query_batcher = SimilarQueryBatcher(SIMILAR_BATCH_WINDOW_MS, SIMILAR_BATCH_MAX_SIZE)
+
+# ===================================================================
+# Search Sessions
+# ===================================================================
+
+class SearchSession:
+    """
+    Cached query embedding plus a lazily extended, ranked candidate list
+    over one or more indexes. Pages are slices of the candidate list; when
+    a page runs past it, the search depth is doubled and re-run.
+    """
+    def __init__(self, query_emb: np.ndarray, indexes: List[FaissIndex], min_score: float,
+                 dataset: str, footprint: str):
+        self.query_emb = query_emb
+        self.dataset = dataset
+        self.footprint = footprint
+        self.indexes = indexes
+        self.min_score = min_score
+        self.depth = 0
+        self.candidates: List[Dict] = []
+        self.exhausted = not indexes
+        self.last_access = time.monotonic()
+        self.lock = threading.Lock()
+
+    def seed(self, per_index_results: List[List[Dict]], depth: int):
+        """Uses results already searched at `depth` as the initial candidates."""
+        with self.lock:
+            self._merge(per_index_results, depth)
+
+    def _merge(self, per_index_results: List[List[Dict]], depth: int):
+        self.depth = depth
+        merged = [res for results in per_index_results for res in results]
+        merged.sort(key=lambda x: x["score"], reverse=True)
+        self.candidates = [res for res in merged if res["score"] > self.min_score]
+        # An index is exhausted once the depth reaches its size, it returned fewer
+        # hits than asked for, or its lowest hit already falls under the threshold
+        # (results are score-sorted)
+        self.exhausted = all(
+            depth >= fi.index.ntotal or len(results) < depth or results[-1]["score"] <= self.min_score
+            for fi, results in zip(self.indexes, per_index_results)
+        )
+
+    def page(self, offset: int, limit: int) -> Tuple[List[Dict], bool]:
+        """Returns candidates[offset:offset+limit] and whether more may follow."""
+        with self.lock:
+            self.last_access = time.monotonic()
+            while len(self.candidates) < offset + limit and not self.exhausted:
+                depth = max(self.depth * 2, offset + limit)
+                query = np.array([self.query_emb])
+                # Never ask Faiss for more neighbours than an index holds
+                self._merge([fi.search_batch(query, min(depth, fi.index.ntotal))[0] for fi in self.indexes], depth)
+            page = self.candidates[offset:offset + limit]
+            has_more = offset + limit < len(self.candidates) or not self.exhausted
+            return page, has_more
+
+class SearchSessionStore:
+    """In-memory sessions keyed by id, evicted after a TTL or when over capacity (LRU)."""
+    def __init__(self, ttl_seconds: float, max_sessions: int):
+        self.ttl = ttl_seconds
+        self.max_sessions = max_sessions
+        self._sessions: "OrderedDict[str, SearchSession]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def create(self, session: SearchSession) -> str:
+        session_id = uuid.uuid4().hex
+        with self._lock:
+            self._evict()
+            self._sessions[session_id] = session
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+        return session_id
+
+    def get(self, session_id: str) -> Union[SearchSession, None]:
+        with self._lock:
+            self._evict()
+            session = self._sessions.get(session_id)
+            if session is not None:
+                self._sessions.move_to_end(session_id)
+            return session
+
+    def _evict(self):
+        now = time.monotonic()
+        expired = [sid for sid, session in self._sessions.items() if now - session.last_access > self.ttl]
+        for sid in expired:
+            del self._sessions[sid]
+
+search_sessions = SearchSessionStore(SEARCH_SESSION_TTL_SECONDS, SEARCH_SESSION_MAX)
+
+def make_cursor(session_id: str, offset: int) -> str:
+    return f"{session_id}.{offset}"
+
+def resolve_cursor(cursor: str) -> Tuple[SearchSession, int]:
+    """Looks up the session and offset a cursor points to."""
+    session_id, _, offset = cursor.partition(".")
+    session = search_sessions.get(session_id)
+    if session is None or not offset.isdigit():
+        raise HTTPException(status_code=404, detail="Search session expired or not found.")
+    return session, int(offset)
+
+def first_page(session: SearchSession, top_k: int) -> Dict:
+    """Registers a session and returns its first page with a cursor for the next one."""
+    session_id = search_sessions.create(session)
+    tiles, has_more = session.page(0, top_k)
+    return {"similar_tiles": tiles, "cursor": make_cursor(session_id, top_k) if has_more else None, "has_more": has_more}
+
+# ===================================================================
+# Footprint Catalog
+# ===================================================================
+
+class FootprintCatalog:
+    """Footprint catalog for one dataset with an STRtree over footprint bboxes."""
+    def __init__(self, footprints: List[Dict], mtime: float):
+        self.footprints = [fp for fp in footprints if len(fp.get("bbox") or []) == 4]
+        self.mtime = mtime
+        self.tree = STRtree([box(*fp["bbox"]) for fp in self.footprints])
+
+    def query(self, geom) -> List[int]:
+        """Indices of footprints intersecting geom, in catalog order so pages are stable."""
+        return sorted(int(i) for i in self.tree.query(geom, predicate="intersects"))
+
+    @staticmethod
+    def summarize(fp: Dict) -> Dict:
+        download_info = fp.get("downloadInfo", {})
+        return {
+            "id": fp.get("id"),
+            "title": fp.get("title"),
+            "bbox": fp["bbox"],
+            "tileUrl": fp.get("tileUrl"),
+            "tilesPerZoom": download_info.get("tilesPerZoom", {}),
+        }
+
+    def page(self, indices: List[int], offset: int, limit: int) -> Dict:
+        return {
+            "total": len(indices),
+            "offset": offset,
+            "limit": limit,
+            "footprints": [self.summarize(self.footprints[i]) for i in indices[offset:offset + limit]],
+        }
+
+footprint_catalogs: Dict[str, FootprintCatalog] = {}
+footprint_catalogs_lock = threading.Lock()
+
+def find_catalog_files() -> Dict[str, str]:
+    """Maps dataset id to its footprint catalog file."""
+    files = {}
+    for catalog_dir in FOOTPRINT_CATALOG_DIRS:
+        if not os.path.isdir(catalog_dir): continue
+        for file in sorted(os.listdir(catalog_dir)):
+            if file.endswith("_footprints.json"):
+                files[file[:-len("_footprints.json")]] = os.path.join(catalog_dir, file)
+    return files
+
+def get_footprint_catalog(dataset_id: str) -> FootprintCatalog:
+    """Returns the spatial catalog for a dataset, loading it once and reloading only if the file changed."""
+    path = find_catalog_files().get(dataset_id)
+    if path is None:
+        raise HTTPException(status_code=404, detail=f"No footprint catalog for dataset '{dataset_id}'.")
+    mtime = os.path.getmtime(path)
+    with footprint_catalogs_lock:
+        catalog = footprint_catalogs.get(dataset_id)
+        if catalog is None or catalog.mtime != mtime:
+            try:
+                with open(path, "r") as f:
+                    catalog = FootprintCatalog(json.load(f), mtime)
+            except (json.JSONDecodeError, IOError) as e:
+                raise HTTPException(status_code=500, detail=f"Could not load footprint catalog: {e}")
+            footprint_catalogs[dataset_id] = catalog
+            print(f"Loaded footprint catalog for '{dataset_id}' with {len(catalog.footprints)} footprints ✅")
+        return catalog
+
+def check_page_args(offset: int, limit: int):
+    if offset < 0 or not 0 < limit <= CATALOG_MAX_PAGE_SIZE:
+        raise HTTPException(status_code=400, detail=f"offset must be >= 0 and limit between 1 and {CATALOG_MAX_PAGE_SIZE}.")
+
 # ===================================================================
 # Startup Event
 # ===================================================================
 @app.on_event("startup")
 async def startup_event():
     """Builds Faiss indexes for existing tiles on startup."""
-    global faiss_indexes
+    remove_stale_bundle_temp_dirs()
     print("Checking for cached Faiss indexes...")
-    for dataset_id in os.listdir(TILES_ROOT):
-        dataset_path = os.path.join(TILES_ROOT, dataset_id)
-        if not os.path.isdir(dataset_path): continue
-        for footprint_id in os.listdir(dataset_path):
-            footprint_path = os.path.join(dataset_path, footprint_id)
-            if not os.path.isdir(footprint_path): continue
-            for zoom_str in os.listdir(footprint_path):
-                zoom_path = os.path.join(footprint_path, zoom_str)
-                if not os.path.isdir(zoom_path) or not zoom_str.isdigit(): continue
-                zoom = int(zoom_str)
-                index_key = (dataset_id, footprint_id, zoom)
-                
-                fi = load_faiss_index(f"{dataset_id}_{footprint_id}", zoom)
-                if fi:
-                    faiss_indexes[index_key] = fi
-                    print(f"Loaded Faiss index for '{dataset_id}_{footprint_id}' zoom {zoom} with {fi.index.ntotal} vectors ✅")
-                    continue
-                
-                print(f"No cached index for '{dataset_id}_{footprint_id}' zoom {zoom}. Building...")
-                build_faiss_index_for_footprint_zoom(dataset_id, footprint_id, zoom)
+    missing = []
+    for index_key in discover_footprint_zooms():
+        dataset_id, footprint_id, zoom = index_key
+        fi = load_faiss_index(f"{dataset_id}_{footprint_id}", zoom)
+        if fi:
+            swap_faiss_index(index_key, fi)
+            print(f"Loaded Faiss index for '{dataset_id}_{footprint_id}' zoom {zoom} with {fi.index.ntotal} vectors ✅")
+            continue
+        print(f"No cached index for '{dataset_id}_{footprint_id}' zoom {zoom}. Building...")
+        missing.append(index_key)
+    if missing:
+        build_faiss_indexes_parallel(missing)
 
 
 # ===================================================================
@@ -422,6 +1577,29 @@ def check():
 async def favicon():
     return Response(content=b"", media_type="image/x-icon")
 
+@app.get("/metrics")
+def get_metrics():
+    """Exposes stage latency histograms and counters in Prometheus text format."""
+    with faiss_indexes_lock.read():
+        indexed_vectors = sum(fi.index.ntotal for fi in faiss_indexes.values())
+    return PlainTextResponse(render_metrics() + f"# TYPE anveshak_indexed_vectors gauge\nanveshak_indexed_vectors {indexed_vectors}\n")
+
+@app.get("/debug/profiler")
+def get_profiler_samples():
+    """Returns the sampling profiler's collapsed stacks (flame graph input)."""
+    return PlainTextResponse(profiler.collapsed(), headers={"X-Profiler-Running": str(profiler.running).lower()})
+
+@app.post("/debug/profiler")
+def toggle_profiler(enabled: bool, interval_ms: float = 10.0, reset: bool = False):
+    """Starts or stops the sampling profiler at runtime."""
+    if reset:
+        profiler.reset()
+    if enabled:
+        profiler.start(interval_ms)
+    else:
+        profiler.stop()
+    return {"running": profiler.running, "interval_ms": profiler.interval * 1000, "samples": sum(profiler.samples.values())}
+
 @app.get("/tiles/{dataset}/{footprint}/{z}/{x}/{y}.{ext}")
 def get_tile(dataset: str, footprint: str, z: int, x: int, y: int, ext: str):
     """Retrieves a specific tile image."""
@@ -498,6 +1676,33 @@ def get_dataset_bounds(dataset: str, footprint: str):
         "available_zooms": sorted(list(zoom_levels.keys()))
     }
 
+# --- Footprint Catalog Endpoints ---
+
+@app.get("/catalog")
+def list_footprint_catalogs():
+    """Lists datasets that have a footprint catalog."""
+    return {"datasets": sorted(find_catalog_files().keys())}
+
+@app.get("/catalog/{dataset_id}/footprints")
+def query_catalog_bbox(dataset_id: str, bbox: str, offset: int = 0, limit: int = CATALOG_PAGE_SIZE):
+    """Pages through catalog footprints intersecting bbox=minLng,minLat,maxLng,maxLat."""
+    check_page_args(offset, limit)
+    try:
+        min_lng, min_lat, max_lng, max_lat = [float(c) for c in bbox.split(",")]
+    except ValueError:
+        raise HTTPException(status_code=400, detail="bbox must be 'minLng,minLat,maxLng,maxLat'.")
+    if min_lng > max_lng or min_lat > max_lat:
+        raise HTTPException(status_code=400, detail="bbox minimums must not exceed maximums.")
+    catalog = get_footprint_catalog(dataset_id)
+    return catalog.page(catalog.query(box(min_lng, min_lat, max_lng, max_lat)), offset, limit)
+
+@app.get("/catalog/{dataset_id}/footprints/at")
+def query_catalog_point(dataset_id: str, lng: float, lat: float, offset: int = 0, limit: int = CATALOG_PAGE_SIZE):
+    """Pages through catalog footprints covering a point."""
+    check_page_args(offset, limit)
+    catalog = get_footprint_catalog(dataset_id)
+    return catalog.page(catalog.query(Point(lng, lat)), offset, limit)
+
 # --- Ingestion Endpoints ---
 
 @app.post("/ingest")
@@ -515,6 +1720,18 @@ def cancel_ingestion(req: CancelRequest):
         return {"status": "cancelling", "datasetId": req.datasetId, "footprintId": req.footprintId}
     return {"status": "no_active_job", "datasetId": req.datasetId, "footprintId": req.footprintId}
 
+@app.post("/index/rebuild")
+def rebuild_indexes(req: ReindexRequest):
+    """Rebuilds Faiss indexes for downloaded footprint zooms across a process pool."""
+    tasks = discover_footprint_zooms(req.datasetId, req.footprintId)
+    if not tasks:
+        raise HTTPException(status_code=404, detail="No downloaded tiles match the requested dataset/footprint.")
+    built = build_faiss_indexes_parallel(tasks, workers=req.workers, threads_per_worker=req.threadsPerWorker)
+    return {
+        "requested": len(tasks),
+        "built": [{"dataset": d, "footprint": f, "zoom": z, "vectors": n} for (d, f, z), n in built.items()],
+    }
+
 @app.get("/ingest/status/{dataset_id}/{footprint_id}")
 def get_ingestion_status(dataset_id: str, footprint_id: str):
     """Checks for downloaded zoom levels for a given dataset footprint."""
@@ -591,110 +1808,97 @@ def delete_annotation(annotation_id: str, dataset: str, footprint: str):
 # --- Similar Feature Search Endpoints ---
 
 @app.post("/annotations/similar")
-def find_similar_by_feature(req: SimilarRequest, zoom: int, top_k: int):
+def find_similar_by_feature(req: SimilarRequest, zoom: int, top_k: int = Query(..., ge=1)):
     """Finds tiles similar to a given annotation feature at a specific zoom level."""
-    index_key = (req.dataset, req.footprint, zoom)
-    if index_key not in faiss_indexes:
+    faiss_index = get_faiss_index((req.dataset, req.footprint, zoom))
+    if faiss_index is None:
         raise HTTPException(status_code=404, detail=f"No Faiss index for '{req.dataset}/{req.footprint}' at zoom {zoom}.")
     
-    faiss_index = faiss_indexes[index_key]
-    feature_shape = shape(req.geojson['geometry'])
-    min_lng, min_lat, max_lng, max_lat = feature_shape.bounds
-    min_tx, min_ty = latlng_to_tilexy(max_lat, min_lng, zoom)
-    max_tx, max_ty = latlng_to_tilexy(min_lat, max_lng, zoom)
-    
-    # Stitching logic
-    cropped_pieces = []
-    for tx in range(min_tx, max_tx + 1):
-        for ty in range(min_ty, max_ty + 1):
-            tile_path = os.path.join(TILES_ROOT, req.dataset, req.footprint, str(zoom), str(tx), f"{ty}.png")
-            if not os.path.exists(tile_path): continue
-            bbox = projection.get_pixel_bbox_on_tile(req.geojson, zoom, tx, ty)
-            if bbox is None: continue
-            tile_img = Image.open(tile_path)
-            cropped_piece = tile_img.crop(bbox)
-            relative_x, relative_y = (tx - min_tx) * 256, (ty - min_ty) * 256
-            cropped_pieces.append({"image": cropped_piece, "paste_x": relative_x + bbox[0], "paste_y": relative_y + bbox[1]})
-    
-    if not cropped_pieces:
-        raise HTTPException(status_code=404, detail="Could not find any tiles overlapping the annotation.")
-    
-    min_paste_x = min(p['paste_x'] for p in cropped_pieces)
-    min_paste_y = min(p['paste_y'] for p in cropped_pieces)
-    max_paste_x = max(p['paste_x'] + p['image'].width for p in cropped_pieces)
-    max_paste_y = max(p['paste_y'] + p['image'].height for p in cropped_pieces)
-    composite_width, composite_height = max_paste_x - min_paste_x, max_paste_y - min_paste_y
-    if composite_width <= 0 or composite_height <= 0:
-        raise HTTPException(status_code=400, detail="Composite image has invalid dimensions.")
-    composite_img = Image.new("RGB", (composite_width, composite_height))
-    for p in cropped_pieces:
-        composite_img.paste(p['image'], (p['paste_x'] - min_paste_x, p['paste_y'] - min_paste_y))
-    model_input_size = config['input_size'][1:]
-    padded_img = ImageOps.pad(composite_img, model_input_size, color='gray')
+    min_lng, min_lat, max_lng, max_lat = shape(req.geojson['geometry']).bounds
+    padded_img = stitch_query_image(req.dataset, req.footprint, req.geojson, zoom,
+                                    "Could not find any tiles overlapping the annotation.")
     
-    query_emb = extract_features(padded_img)
-    initial_search_k = max(50, top_k * 5)
-    initial_results = faiss_index.search(query_emb, initial_search_k)
-    high_confidence_results = [res for res in initial_results if res["score"] > 0.75]
-    medium_confidence_results = [res for res in initial_results if 0.60 < res["score"] <= 0.75]
-    final_results = (high_confidence_results + medium_confidence_results)[:top_k]
+    initial_search_k = min(max(SEARCH_SESSION_INITIAL_K, top_k * 2), faiss_index.index.ntotal)
+    query_emb, initial_results = similar_query_batcher.submit(padded_img, faiss_index, initial_search_k).result()
+    session = SearchSession(query_emb, [faiss_index], 0.60, req.dataset, req.footprint)
+    session.seed([initial_results], initial_search_k)
     
     return {
         "query_feature_bounds": [min_lng, min_lat, max_lng, max_lat],
-        "similar_tiles": final_results,
+        **first_page(session, top_k),
     }
 
-@app.post("/annotations/similar/more")
-def find_similar_by_feature_more(req: SimilarMoreRequest, top_k: int):
-    """Finds similar tiles across different zoom levels of a dataset footprint."""
-    QUERY_ZOOM_LEVEL = 5 
-    feature_shape = shape(req.geojson['geometry'])
-    min_lng, min_lat, max_lng, max_lat = feature_shape.bounds
-    min_tx, min_ty = latlng_to_tilexy(max_lat, min_lng, QUERY_ZOOM_LEVEL)
-    max_tx, max_ty = latlng_to_tilexy(min_lat, max_lng, QUERY_ZOOM_LEVEL)
+@app.post("/annotations/similar/batch")
+def find_similar_by_feature_batch(req: SimilarBatchRequest, zoom: int, top_k: int = Query(..., ge=1)):
+    """Finds similar tiles for many annotation features with one forward pass and one index search."""
+    faiss_index = get_faiss_index((req.dataset, req.footprint, zoom))
+    if faiss_index is None:
+        raise HTTPException(status_code=404, detail=f"No Faiss index for '{req.dataset}/{req.footprint}' at zoom {zoom}.")
     
-    # Stitching logic
-    cropped_pieces = []
-    for tx in range(min_tx, max_tx + 1):
-        for ty in range(min_ty, max_ty + 1):
-            tile_path = os.path.join(TILES_ROOT, req.dataset, req.footprint, str(QUERY_ZOOM_LEVEL), str(tx), f"{ty}.png")
-            if not os.path.exists(tile_path): continue
-            bbox = projection.get_pixel_bbox_on_tile(req.geojson, QUERY_ZOOM_LEVEL, tx, ty)
-            if bbox is None: continue
-            tile_img = Image.open(tile_path)
-            cropped_piece = tile_img.crop(bbox)
-            relative_x, relative_y = (tx - min_tx) * 256, (ty - min_ty) * 256
-            cropped_pieces.append({"image": cropped_piece, "paste_x": relative_x + bbox[0], "paste_y": relative_y + bbox[1]})
+    entries, images = [], []
+    for query in req.queries:
+        entry = {"annotation_id": query.annotation_id, "query_feature_bounds": list(shape(query.geojson['geometry']).bounds)}
+        try:
+            images.append(stitch_query_image(req.dataset, req.footprint, query.geojson, zoom,
+                                             "Could not find any tiles overlapping the annotation."))
+        except HTTPException as e:
+            entry["error"] = e.detail
+        entries.append(entry)
     
-    if not cropped_pieces:
-        raise HTTPException(status_code=404, detail=f"Could not find tiles for query at zoom {QUERY_ZOOM_LEVEL}.")
+    if images:
+        # Bound the forward pass size; a request may carry any number of geometries
+        query_embs = np.concatenate([
+            extract_features_batch(images[i:i + SIMILAR_BATCH_MAX_SIZE])
+            for i in range(0, len(images), SIMILAR_BATCH_MAX_SIZE)
+        ])
+        initial_search_k = min(max(SEARCH_SESSION_INITIAL_K, top_k * 2), faiss_index.index.ntotal)
+        batch_results = iter(zip(query_embs, faiss_index.search_batch(query_embs, initial_search_k)))
+        for entry in entries:
+            if "error" not in entry:
+                query_emb, results = next(batch_results)
+                session = SearchSession(query_emb, [faiss_index], 0.60, req.dataset, req.footprint)
+                session.seed([results], initial_search_k)
+                entry.update(first_page(session, top_k))
     
-    min_paste_x = min(p['paste_x'] for p in cropped_pieces)
-    min_paste_y = min(p['paste_y'] for p in cropped_pieces)
-    max_paste_x = max(p['paste_x'] + p['image'].width for p in cropped_pieces)
-    max_paste_y = max(p['paste_y'] + p['image'].height for p in cropped_pieces)
-    composite_width, composite_height = max_paste_x - min_paste_x, max_paste_y - min_paste_y
-    if composite_width <= 0 or composite_height <= 0:
-        raise HTTPException(status_code=400, detail="Composite image has invalid dimensions.")
-    composite_img = Image.new("RGB", (composite_width, composite_height))
-    for p in cropped_pieces:
-        composite_img.paste(p['image'], (p['paste_x'] - min_paste_x, p['paste_y'] - min_paste_y))
-    model_input_size = config['input_size'][1:]
-    padded_img = ImageOps.pad(composite_img, model_input_size, color='gray')
-    query_emb = extract_features(padded_img)
+    return {"results": entries}
+
+@app.post("/annotations/similar/more")
+def find_similar_by_feature_more(req: SimilarMoreRequest, top_k: int = Query(..., ge=1)):
+    """
+    Finds similar tiles across different zoom levels of a dataset footprint.
+    With a cursor, the embedding of that earlier search is reused; it was taken
+    from the crop at the original search's zoom, not at QUERY_ZOOM_LEVEL.
+    """
+    QUERY_ZOOM_LEVEL = 5 
+    if req.cursor:
+        # Reuse the embedding from an earlier search instead of re-stitching
+        previous = resolve_cursor(req.cursor)[0]
+        if (previous.dataset, previous.footprint) != (req.dataset, req.footprint):
+            raise HTTPException(status_code=400, detail="Cursor belongs to a search on a different dataset footprint.")
+        query_emb = previous.query_emb
+    else:
+        padded_img = stitch_query_image(req.dataset, req.footprint, req.geojson, QUERY_ZOOM_LEVEL,
+                                        f"Could not find tiles for query at zoom {QUERY_ZOOM_LEVEL}.")
+        query_emb, _ = similar_query_batcher.submit(padded_img, None, 0).result()
     
-    all_results = []
-    initial_search_k = max(50, top_k * 5)
-    for index_key, faiss_index in faiss_indexes.items():
+    indexes = []
+    for index_key, faiss_index in faiss_index_snapshot():
         dataset_name, footprint_name, zoom_level = index_key
         if dataset_name == req.dataset and footprint_name == req.footprint and zoom_level not in req.exclude_zooms:
             print(f"Searching deeper in index for zoom level {zoom_level}...")
-            results_from_zoom = faiss_index.search(query_emb, initial_search_k)
-            all_results.extend(results_from_zoom)
+            indexes.append(faiss_index)
     
-    all_results.sort(key=lambda x: x["score"], reverse=True)
-    high_confidence_results = [res for res in all_results if res["score"] > 0.75]
-    medium_confidence_results = [res for res in all_results if 0.65 < res["score"] <= 0.75]
-    final_results = (high_confidence_results + medium_confidence_results)[:top_k]
-    
-    return {"similar_tiles": final_results}
\ No newline at end of file
+    session = SearchSession(query_emb, indexes, 0.65, req.dataset, req.footprint)
+    return first_page(session, top_k)
+
+@app.get("/annotations/similar/page")
+def get_similar_page(cursor: str, top_k: int = Query(..., ge=1)):
+    """Returns the next page of a similarity search from its cached ranked candidates."""
+    session, offset = resolve_cursor(cursor)
+    tiles, has_more = session.page(offset, top_k)
+    session_id = cursor.partition(".")[0]
+    return {
+        "similar_tiles": tiles,
+        "cursor": make_cursor(session_id, offset + top_k) if has_more else None,
+        "has_more": has_more,
+    }
@@ -0,0 +1,33 @@
+"""
+Rebuilds Faiss indexes for downloaded tiles across a process pool.
+
+Usage (from the repository root):
+    python -m backend.reindex --workers 16 --threads-per-worker 4
+    python -m backend.reindex --dataset hirise --footprint test_data
+"""
+import argparse
+import time
+
+from backend.main import build_faiss_indexes_parallel, discover_footprint_zooms
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild Faiss indexes in parallel.")
+    parser.add_argument("--dataset", help="Only reindex this dataset")
+    parser.add_argument("--footprint", help="Only reindex this footprint")
+    parser.add_argument("--workers", type=int, help="Worker processes (default: CPU count / threads per worker)")
+    parser.add_argument("--threads-per-worker", type=int, help="Torch threads pinned per worker")
+    args = parser.parse_args()
+
+    tasks = discover_footprint_zooms(args.dataset, args.footprint)
+    if not tasks:
+        print("No downloaded footprint zooms found.")
+        return
+
+    start = time.perf_counter()
+    built = build_faiss_indexes_parallel(tasks, workers=args.workers, threads_per_worker=args.threads_per_worker)
+    elapsed = time.perf_counter() - start
+    vectors = sum(built.values())
+    print(f"\n✅ Done. Built {len(built)}/{len(tasks)} indexes ({vectors} vectors) in {elapsed:.1f}s")
+
+if __name__ == "__main__":
+    main()
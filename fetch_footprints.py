@@ -2,13 +2,24 @@ import requests
 import json
 import os
 import time
+import hashlib
+import threading
+import argparse
 import xml.etree.ElementTree as ET
 import math
+from concurrent.futures import ThreadPoolExecutor
 
 # --- CONFIGURATION ---
-CATALOG_API_URL = "https://trek.nasa.gov/mars/TrekServices/ws/index/eq/searchItems?proj=eq&start=0&rows=5000&facetKeys=instrument%7CproductCat1&facetValues=CTX%7CImagery&intersects=true"
-LAYER_SERVICE_API_TEMPLATE = "https://trek.nasa.gov/mars/TrekServices/ws/index/getLayerServices?uuid={}"
+TREK_BASE_URL = "https://trek.nasa.gov"
+CATALOG_API_URL = TREK_BASE_URL + "/mars/TrekServices/ws/index/eq/searchItems?proj=eq&start=0&rows=5000&facetKeys=instrument%7CproductCat1&facetValues=CTX%7CImagery&intersects=true"
+LAYER_SERVICE_API_TEMPLATE = TREK_BASE_URL + "/mars/TrekServices/ws/index/getLayerServices?uuid={}"
+TILES_BASE_URL = TREK_BASE_URL + "/tiles"
 OUTPUT_PATH = os.path.join("frontend", "static", "ctx_footprints.json")
+CACHE_DIR = os.path.join(".cache", "trek_http")
+
+MAX_WORKERS = 8             # Concurrent footprint fetches
+MAX_REQUESTS_PER_SECOND = 10  # Be polite to the server
+REQUEST_TIMEOUT = 30
 
 # Mapping footprint titles → public mosaic dataset names
 DATASET_MAP = {
@@ -84,14 +95,155 @@ def calculate_tiles_per_zoom(zoom_levels, bbox):
 
 
 
-def fetch_and_process_footprints(limit=None):
-    """Fetch CTX footprints and calculate correct tile download information"""
-    print(f"STEP 1: Fetching master catalog from: {CATALOG_API_URL}")
-    try:
-        response = requests.get(CATALOG_API_URL)
+class RateLimiter:
+    """Spaces requests at least 1/rate seconds apart across all threads"""
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0.0
+        self.next_slot = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot)
+            self.next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+class HttpCache:
+    """
+    Persistent on-disk cache for GET responses. Cached entries are
+    revalidated with If-None-Match / If-Modified-Since, so unchanged
+    responses cost a 304 instead of a full download.
+    """
+    def __init__(self, cache_dir, rate_limiter, timeout=REQUEST_TIMEOUT):
+        self.cache_dir = cache_dir
+        self.rate_limiter = rate_limiter
+        self.timeout = timeout
+        self.local = threading.local()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _session(self):
+        # requests.Session is not thread-safe, so each worker thread gets its own
+        if not hasattr(self.local, "session"):
+            self.local.session = requests.Session()
+        return self.local.session
+
+    def _paths(self, url):
+        key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, f"{key}.json"), os.path.join(self.cache_dir, f"{key}.body")
+
+    def get(self, url):
+        """Returns the response body for url, served from cache when the server reports 304"""
+        meta_path, body_path = self._paths(url)
+        meta = None
+        if os.path.exists(meta_path) and os.path.exists(body_path):
+            try:
+                with open(meta_path, "r") as f:
+                    meta = json.load(f)
+            except (ValueError, IOError):
+                meta = None  # Corrupt cache entry; refetch unconditionally
+
+        headers = {}
+        if meta:
+            if meta.get("etag"):
+                headers["If-None-Match"] = meta["etag"]
+            if meta.get("lastModified"):
+                headers["If-Modified-Since"] = meta["lastModified"]
+
+        self.rate_limiter.wait()
+        response = self._session().get(url, headers=headers, timeout=self.timeout)
+        if response.status_code == 304 and meta:
+            with open(body_path, "rb") as f:
+                return f.read()
         response.raise_for_status()
-        catalog_data = response.json()
-    except requests.exceptions.RequestException as e:
+
+        for path, data, mode in ((body_path, response.content, "wb"),
+                                 (meta_path, json.dumps({"url": url,
+                                                         "etag": response.headers.get("ETag"),
+                                                         "lastModified": response.headers.get("Last-Modified")}), "w")):
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, mode) as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        return response.content
+
+def item_fingerprint(item):
+    """Stable hash of a catalog item, used to detect new or changed footprints"""
+    return hashlib.sha256(json.dumps(item, sort_keys=True).encode("utf-8")).hexdigest()
+
+def load_existing_footprints(output_path):
+    """Loads previously processed footprints keyed by id"""
+    if not os.path.exists(output_path):
+        return {}
+    try:
+        with open(output_path, "r") as f:
+            return {fp["id"]: fp for fp in json.load(f) if "id" in fp}
+    except (json.JSONDecodeError, IOError):
+        return {}
+
+def process_footprint(item, http, layer_service_template, tiles_base_url):
+    """Fetch layer services and WMTS capabilities for one catalog item"""
+    uuid = item.get("item_UUID")
+    title = item.get("title")
+    bbox_str = item.get("bbox")
+
+    layer_data = json.loads(http.get(layer_service_template.format(uuid)))
+    docs = layer_data.get("response", {}).get("docs", [])
+    if not docs:
+        print(f"    - {title}: No layer service docs found. Skipping.")
+        return None
+
+    tile_endpoint = docs[0].get("endPoint")
+    if not tile_endpoint:
+        print(f"    - {title}: No tile endpoint found. Skipping.")
+        return None
+
+    bbox = [float(c) for c in bbox_str.split(",")]
+    dataset_name = DATASET_MAP.get(title)
+
+    # Corrected URL format to {z}/{y}/{x}
+    if dataset_name:
+        tile_url_template = f"{tiles_base_url}/Mars/EQ/{dataset_name}/1.0.0//default/default028mm/{{z}}/{{y}}/{{x}}.png"
+        capabilities_url = f"{tiles_base_url}/Mars/EQ/{dataset_name}/1.0.0/WMTSCapabilities.xml"
+    else:
+        tile_url_template = f"{tile_endpoint}/1.0.0/default/default028mm/{{z}}/{{y}}/{{x}}.png"
+        capabilities_url = f"{tile_endpoint}/1.0.0/WMTSCapabilities.xml"
+
+    footprint = {
+        "id": uuid,
+        "title": title,
+        "bbox": bbox,
+        "tileUrl": tile_url_template,
+        "capabilitiesUrl": capabilities_url,
+        "sourceHash": item_fingerprint(item),
+    }
+
+    xml_root = ET.fromstring(http.get(capabilities_url))
+    zoom_levels = extract_zoom_levels(xml_root)
+    if zoom_levels:
+        tiles_per_zoom = calculate_tiles_per_zoom(zoom_levels, bbox)
+        footprint["downloadInfo"] = {"tilesPerZoom": tiles_per_zoom}
+        print(f"    - {title}: Calculated tile ranges for zoom levels: {list(tiles_per_zoom.keys())}")
+    else:
+        footprint["downloadInfo"] = {"error": "No relevant zoom levels found"}
+        print(f"    - {title}: No relevant zoom levels (6-13) found in capabilities.")
+    return footprint
+
+def fetch_and_process_footprints(limit=None, catalog_url=CATALOG_API_URL, layer_service_template=LAYER_SERVICE_API_TEMPLATE,
+                                 tiles_base_url=TILES_BASE_URL, output_path=OUTPUT_PATH, cache_dir=CACHE_DIR,
+                                 max_workers=MAX_WORKERS, max_requests_per_second=MAX_REQUESTS_PER_SECOND):
+    """
+    Fetch CTX footprints and calculate correct tile download information.
+    Items already in output_path with an unchanged catalog entry are reused;
+    only new or changed items are fetched, concurrently and rate limited.
+    """
+    http = HttpCache(cache_dir, RateLimiter(max_requests_per_second))
+
+    print(f"STEP 1: Fetching master catalog from: {catalog_url}")
+    try:
+        catalog_data = json.loads(http.get(catalog_url))
+    except (requests.exceptions.RequestException, ValueError) as e:
         print(f"Error: Failed to fetch master catalog. {e}")
         return
 
@@ -101,79 +253,51 @@ def fetch_and_process_footprints(limit=None):
         footprint_docs = footprint_docs[:limit]
         print(f"Limiting to top {limit} footprints for processing.")
 
-    processed = []
+    existing = load_existing_footprints(output_path)
+    results = [None] * len(footprint_docs)
+    to_fetch = []
     for i, item in enumerate(footprint_docs):
-        uuid = item.get("item_UUID")
-        title = item.get("title")
-        bbox_str = item.get("bbox")
-
-        if not (uuid and title and bbox_str):
-            print(f"  ({i+1}/{limit or len(footprint_docs)}) Skipping invalid item.")
+        if not (item.get("item_UUID") and item.get("title") and item.get("bbox")):
+            print(f"  ({i+1}/{len(footprint_docs)}) Skipping invalid item.")
             continue
+        previous = existing.get(item["item_UUID"])
+        if previous and previous.get("sourceHash") == item_fingerprint(item) and "tilesPerZoom" in previous.get("downloadInfo", {}):
+            results[i] = previous
+        else:
+            to_fetch.append(i)
+    print(f"STEP 2: {len(footprint_docs) - len(to_fetch)} footprints unchanged, fetching {len(to_fetch)} new or changed.")
 
-        print(f"  ({i+1}/{limit or len(footprint_docs)}) Processing: {title}")
-
+    def fetch(i):
+        item = footprint_docs[i]
+        title = item.get("title")
         try:
-            layer_url = LAYER_SERVICE_API_TEMPLATE.format(uuid)
-            layer_res = requests.get(layer_url)
-            layer_res.raise_for_status()
-            layer_data = layer_res.json()
-            
-            docs = layer_data.get("response", {}).get("docs", [])
-            if not docs:
-                print("    - No layer service docs found. Skipping.")
-                continue
-            
-            tile_endpoint = docs[0].get("endPoint")
-            if not tile_endpoint:
-                print("    - No tile endpoint found. Skipping.")
-                continue
-
-            bbox = [float(c) for c in bbox_str.split(",")]
-            dataset_name = DATASET_MAP.get(title)
-            
-            # Corrected URL format to {z}/{y}/{x}
-            if dataset_name:
-                tile_url_template = f"https://trek.nasa.gov/tiles/Mars/EQ/{dataset_name}/1.0.0//default/default028mm/{{z}}/{{y}}/{{x}}.png"
-                capabilities_url = f"https://trek.nasa.gov/tiles/Mars/EQ/{dataset_name}/1.0.0/WMTSCapabilities.xml"
-            else:
-                tile_url_template = f"{tile_endpoint}/1.0.0/default/default028mm/{{z}}/{{y}}/{{x}}.png"
-                capabilities_url = f"{tile_endpoint}/1.0.0/WMTSCapabilities.xml"
-
-            footprint = {
-                "id": uuid,
-                "title": title,
-                "bbox": bbox,
-                "tileUrl": tile_url_template,
-                "capabilitiesUrl": capabilities_url
-            }
-
-            cap_res = requests.get(capabilities_url)
-            cap_res.raise_for_status()
-            xml_root = ET.fromstring(cap_res.content)
-            
-            zoom_levels = extract_zoom_levels(xml_root)
-            if zoom_levels:
-                bbox_full = [-180, -90, 180, 90]  # Mars global extent
-                tiles_per_zoom = calculate_tiles_per_zoom(zoom_levels, bbox)
-                footprint["downloadInfo"] = {"tilesPerZoom": tiles_per_zoom}
-                print(f"    - Calculated tile ranges for zoom levels: {list(tiles_per_zoom.keys())}")
-            else:
-                footprint["downloadInfo"] = {"error": "No relevant zoom levels found"}
-                print("    - No relevant zoom levels (6-13) found in capabilities.")
-
-            processed.append(footprint)
-            time.sleep(0.2) # Be polite to the server
-
+            return process_footprint(item, http, layer_service_template, tiles_base_url)
         except requests.exceptions.RequestException as e:
             print(f"    - Network Error for {title}: {e}")
         except Exception as e:
             print(f"    - An unexpected error occurred for {title}: {e}")
+        # Keep the last known good entry rather than dropping the footprint
+        return existing.get(item["item_UUID"])
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        for i, footprint in zip(to_fetch, pool.map(fetch, to_fetch)):
+            results[i] = footprint
 
-    os.makedirs(os.path.dirname(OUTPUT_PATH), exist_ok=True)
-    with open(OUTPUT_PATH, "w") as f:
+    processed = [fp for fp in results if fp]
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    tmp_path = f"{output_path}.tmp"
+    with open(tmp_path, "w") as f:
         json.dump(processed, f, indent=2)
-    print(f"\n✅ Done. Saved {len(processed)} footprints to {OUTPUT_PATH}")
+    os.replace(tmp_path, output_path)
+    print(f"\n✅ Done. Saved {len(processed)} footprints to {output_path}")
 
 if __name__ == "__main__":
-    fetch_and_process_footprints(limit=10)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Fetch CTX footprints from the Trek catalog.")
+    parser.add_argument("--limit", type=int, default=None, help="Only process the first N catalog items")
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS)
+    parser.add_argument("--rate", type=float, default=MAX_REQUESTS_PER_SECOND, help="Max requests per second")
+    parser.add_argument("--output", default=OUTPUT_PATH)
+    parser.add_argument("--cache-dir", default=CACHE_DIR)
+    args = parser.parse_args()
+    fetch_and_process_footprints(limit=args.limit, output_path=args.output, cache_dir=args.cache_dir,
+                                 max_workers=args.workers, max_requests_per_second=args.rate)